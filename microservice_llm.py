@@ -5,18 +5,25 @@ Includes monitoring, tracing, and service discovery capabilities.
 """
 
 # Standard library imports
+import asyncio
 from datetime import UTC, datetime
+import hashlib
 import logging
 import os
 import time
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
 # Third-party imports
+from cachetools import TTLCache
 import consul
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import groq
+import httpx
+import msgpack
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc import (
     trace_exporter
@@ -24,16 +31,39 @@ from opentelemetry.exporter.otlp.proto.grpc import (
 from opentelemetry.instrumentation import fastapi
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace import export
-from prometheus_client import Counter, Histogram, generate_latest
-from pydantic import BaseModel
-from tenacity import retry, stop_after_attempt, wait_exponential
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pydantic import BaseModel, Field
+from redis import asyncio as aioredis
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.middleware import SlowAPIMiddleware
+from slowapi.util import get_remote_address
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 import uvicorn
 
+if TYPE_CHECKING:
+    # Semantic cache dependencies are imported only when the cache is enabled
+    import numpy as np
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
+logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -43,6 +73,7 @@ app = FastAPI(
     title="LLM Text Generation Microservice",
     description="A microservice for text generation with Groq LLM",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware to allow cross-origin requests
@@ -54,6 +85,48 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Add per-client rate limiting, shared through Redis when REDIS_URL is set
+# Moving window so a rejected multi-item batch does not use up the budget
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("REDIS_URL", "memory://"),
+    strategy="moving-window",
+)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_middleware(SlowAPIMiddleware)
+
+# Limit shared by all generation endpoints, counted in Groq calls requested
+GENERATION_RATE_LIMIT = os.getenv("RATE_LIMIT", "30/minute")
+GENERATION_RATE_SCOPE = "generate"
+
+
+def batch_cost(request: Request) -> int:
+    """Charge a batch request one rate limit hit per item.
+
+    FastAPI has already parsed and validated the JSON body by the time the
+    limiter runs, and Starlette caches the parsed value on the request as
+    ``_json``. That attribute is private, so its absence is an error rather
+    than a reason to charge a single hit.
+
+    Args:
+        request: Incoming batch generation request.
+
+    Returns:
+        int: Number of items in the batch.
+
+    Raises:
+        RuntimeError: If the parsed body is not available on the request.
+    """
+    try:
+        return len(request._json["items"])
+    except (AttributeError, KeyError, TypeError) as e:
+        raise RuntimeError(
+            "Parsed batch body not found on the request; cannot charge the "
+            "rate limit per item"
+        ) from e
+
+
 # Initialize Prometheus metrics for monitoring
 REQUEST_COUNT = Counter(
     "request_count",
@@ -63,47 +136,83 @@ GENERATION_TIME = Histogram(
     "generation_time_seconds",
     "Time spent generating text",
 )
+TIME_TO_FIRST_TOKEN = Histogram(
+    "time_to_first_token_seconds",
+    "Time until the first token of a streamed generation",
+)
 ERROR_COUNT = Counter(
     "error_count",
     "Total number of errors",
+    ["kind"],
+)
+CACHE_HITS = Counter(
+    "cache_hits",
+    "Total number of generation requests served from cache",
+    ["tier"],
+)
+SEMANTIC_HITS = Counter(
+    "semantic_cache_hits",
+    "Total number of generation requests served by a similar prompt",
+)
+CACHE_MISSES = Counter(
+    "cache_misses",
+    "Total number of generation requests not found in cache",
+)
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests",
+    "Total number of generation requests joined to an in-flight call",
 )
 
-# Initialize OpenTelemetry for distributed tracing
-tracer_provider = TracerProvider()
-try:
-    # Attempt to use OTLP exporter for sending traces
-    otlp_exporter = trace_exporter.OTLPSpanExporter(
-        endpoint=os.getenv(
-            "OTEL_EXPORTER_OTLP_ENDPOINT",
-            "http://localhost:4317",
-        )
-    )
-    span_processor = export.BatchSpanProcessor(otlp_exporter)
-except Exception as e:
-    # Fallback to console exporter if OTLP fails
-    logging.error(
-        "Failed to initialize OTLP exporter, falling back to console: %s",
-        e,
-    )
-    span_processor = export.BatchSpanProcessor(export.ConsoleSpanExporter())
+# Instrument the FastAPI app for distributed tracing when enabled. The
+# exporter is created on startup so importing this module never waits on
+# the collector.
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "0") == "1"
+tracer_provider = None
+if OTEL_ENABLED:
+    fastapi.FastAPIInstrumentor.instrument_app(app)
+
+# Consul, HTTP and Groq clients are created on startup (see init_clients)
+# so importing this module does no network or connection-pool setup
+consul_client: Optional[consul.Consul] = None
+http_client: Optional[httpx.AsyncClient] = None
+groq_client: Optional[groq.AsyncGroq] = None
+
+# Consul health check interval, in seconds
+CONSUL_CHECK_INTERVAL = 10
+consul_heartbeat_task = None
 
-# Set the tracer provider and instrument the FastAPI app
-tracer_provider.add_span_processor(span_processor)
-trace.set_tracer_provider(tracer_provider)
-fastapi.FastAPIInstrumentor.instrument_app(app)
+# Groq model used for all text generation requests
+GROQ_MODEL = os.getenv("GROQ_MODEL", "gemma2-9b-it")
 
-# Initialize Consul client for service discovery
-consul_client = consul.Consul(
-    host=os.getenv("CONSUL_HOST", "localhost"),
-    port=int(os.getenv("CONSUL_PORT", 8500)),
+# Initialize in-process (L1) cache for exact-match generation responses
+CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", 1024))
+response_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+response_cache_lock = asyncio.Lock()
+
+# Redis (L2) cache shared across workers and replicas, created on startup.
+# Keys are prefixed since the database may be shared with the rate limiter.
+redis_client: Optional[aioredis.Redis] = None
+REDIS_KEY_PREFIX = "llm:gen:"
+
+# Semantic cache, loaded on startup when SEMANTIC_CACHE_MODEL_DIR is set.
+# The directory must hold an ONNX export of all-MiniLM-L6-v2 (model.onnx,
+# tokenizer.json).
+SEMANTIC_CACHE_THRESHOLD = float(
+    os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)
 )
+EMBEDDING_DIM = 384
+embedding_session = None
+embedding_tokenizer = None
+semantic_index = None
 
-# Initialize Groq client for LLM interactions
-try:
-    groq_client = groq.Groq(api_key=os.getenv("GROQ_API_KEY"))
-except Exception as e:
-    logging.error("Error initializing Groq client: %s", e)
-    groq_client = None
+# In-flight Groq calls keyed by cache key, shared by identical requests
+inflight_generations: Dict[str, asyncio.Task] = {}
+
+# Bound on concurrent generations fanned out by batch requests
+generation_semaphore = asyncio.Semaphore(
+    int(os.getenv("MAX_CONCURRENCY", 32))
+)
 
 
 class TextGenerationRequest(BaseModel):
@@ -134,6 +243,41 @@ class TextGenerationResponse(BaseModel):
     usage: Dict[str, int]
 
 
+class TextGenerationBatchRequest(BaseModel):
+    """Request model for batch text generation endpoint.
+
+    Attributes:
+        items: The generation requests to run, at most MAX_BATCH_SIZE.
+    """
+
+    items: List[TextGenerationRequest] = Field(
+        min_length=1,
+        max_length=int(os.getenv("MAX_BATCH_SIZE", 16)),
+    )
+
+
+class BatchItemError(BaseModel):
+    """Error for a single failed item of a batch request.
+
+    Attributes:
+        status_code: HTTP status code the item would have failed with.
+        detail: Description of the failure.
+    """
+
+    status_code: int
+    detail: str
+
+
+class TextGenerationBatchResponse(BaseModel):
+    """Response model for batch text generation endpoint.
+
+    Attributes:
+        results: One result per requested item, in request order.
+    """
+
+    results: List[Union[TextGenerationResponse, BatchItemError]]
+
+
 class HealthCheckResponse(BaseModel):
     """Response model for health check endpoint.
 
@@ -154,18 +298,225 @@ class HealthCheckResponse(BaseModel):
     metrics_status: str
 
 
+@app.on_event("startup")
+async def init_clients():
+    """Create the Consul, HTTP, Groq and Redis clients used by the service."""
+    global consul_client, http_client, groq_client, redis_client
+
+    # Initialize Consul client for service discovery
+    consul_client = consul.Consul(
+        host=os.getenv("CONSUL_HOST", "localhost"),
+        port=int(os.getenv("CONSUL_PORT", 8500)),
+    )
+
+    # Initialize shared HTTP connection pool for Groq API calls
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=512,
+            max_keepalive_connections=256,
+            keepalive_expiry=60.0,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+    # Initialize Groq client for LLM interactions
+    try:
+        # Retries are handled by generate_with_retry; disable the SDK's own
+        # so a transient failure is not retried at both layers
+        groq_client = groq.AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            http_client=http_client,
+            max_retries=0,
+        )
+    except Exception as e:
+        logger.error("Error initializing Groq client: %s", e)
+        groq_client = None
+
+    # Initialize Redis client for the distributed cache. Short timeouts keep
+    # the cache fail-open when Redis is unreachable instead of stalling
+    # every request
+    if os.getenv("REDIS_HOST"):
+        redis_client = aioredis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+            socket_connect_timeout=float(
+                os.getenv("REDIS_CONNECT_TIMEOUT", 0.5)
+            ),
+            socket_timeout=float(os.getenv("REDIS_TIMEOUT", 0.5)),
+            decode_responses=False,
+        )
+    else:
+        logger.info("REDIS_HOST not set, distributed cache disabled")
+
+
+def load_embedding_model(model_dir: str):
+    """Load the ONNX sentence embedding model and its tokenizer.
+
+    Args:
+        model_dir: Directory holding ``model.onnx`` and ``tokenizer.json``.
+
+    Returns:
+        tuple: The onnxruntime inference session and the tokenizer.
+    """
+    import onnxruntime
+    from tokenizers import Tokenizer
+
+    session = onnxruntime.InferenceSession(
+        os.path.join(model_dir, "model.onnx"),
+        providers=["CPUExecutionProvider"],
+    )
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=256)
+    return session, tokenizer
+
+
+@app.on_event("startup")
+async def init_semantic_cache():
+    """Load the embedding model and index if the semantic cache is enabled."""
+    global embedding_session, embedding_tokenizer, semantic_index
+    model_dir = os.getenv("SEMANTIC_CACHE_MODEL_DIR")
+    if not model_dir:
+        logger.info("SEMANTIC_CACHE_MODEL_DIR not set, semantic cache off")
+        return
+
+    try:
+        embedding_session, embedding_tokenizer = await asyncio.to_thread(
+            load_embedding_model, model_dir
+        )
+    except Exception as e:
+        logger.error("Error initializing semantic cache model: %s", e)
+        return
+    semantic_index = SemanticIndex(CACHE_MAXSIZE, EMBEDDING_DIM, CACHE_TTL)
+
+
+@app.on_event("startup")
+async def init_tracing():
+    """Install the OpenTelemetry span exporter if tracing is enabled."""
+    global tracer_provider
+    if not OTEL_ENABLED:
+        return
+
+    tracer_provider = TracerProvider()
+    try:
+        # Attempt to use OTLP exporter for sending traces
+        otlp_exporter = trace_exporter.OTLPSpanExporter(
+            endpoint=os.getenv(
+                "OTEL_EXPORTER_OTLP_ENDPOINT",
+                "http://localhost:4317",
+            ),
+            insecure=True,
+            timeout=2,
+        )
+        span_processor = export.BatchSpanProcessor(otlp_exporter)
+    except Exception as e:
+        # Fallback to console exporter if OTLP fails
+        logger.error(
+            "Failed to initialize OTLP exporter, falling back to console: %s",
+            e,
+        )
+        span_processor = export.BatchSpanProcessor(
+            export.ConsoleSpanExporter()
+        )
+
+    tracer_provider.add_span_processor(span_processor)
+    trace.set_tracer_provider(tracer_provider)
+
+
+@app.on_event("shutdown")
+async def shutdown_tracing():
+    """Flush pending spans and stop the exporter thread on shutdown."""
+    if tracer_provider is not None:
+        tracer_provider.shutdown()
+
+
+def register_service():
+    """Register this service and its health check with Consul."""
+    consul_client.agent.service.register(
+        "llm-service",
+        service_id="llm-service-1",
+        port=8000,
+        check={
+            "http": "http://localhost:8000/health",
+            "interval": f"{CONSUL_CHECK_INTERVAL}s",
+        },
+    )
+
+
+async def consul_heartbeat():
+    """Periodically refresh the Consul registration in the background."""
+    while True:
+        await asyncio.sleep(CONSUL_CHECK_INTERVAL - 2)
+        try:
+            await asyncio.to_thread(register_service)
+        except Exception as e:
+            logger.error("Failed to refresh Consul registration: %s", e)
+
+
+@app.on_event("startup")
+async def register_with_consul():
+    """Register with Consul once and start the refresh task."""
+    global consul_heartbeat_task
+    try:
+        await asyncio.to_thread(register_service)
+    except Exception as e:
+        logger.error("Failed to register with Consul: %s", e)
+    consul_heartbeat_task = asyncio.create_task(consul_heartbeat())
+
+
+@app.on_event("shutdown")
+async def stop_consul_heartbeat():
+    """Stop the Consul refresh task on shutdown."""
+    if consul_heartbeat_task is not None:
+        consul_heartbeat_task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Close the shared HTTP connection pool on shutdown."""
+    if http_client is not None:
+        await http_client.aclose()
+
+
+@app.on_event("shutdown")
+async def close_redis_client():
+    """Close the Redis connection pool on shutdown."""
+    if redis_client is not None:
+        await redis_client.aclose()
+
+
 @app.get("/")
 async def root():
     """Return basic service health status.
 
     Returns:
-        dict: Basic health status information.
+        ORJSONResponse: Basic health status information.
     """
-    logging.info("Health check endpoint accessed")
-    return {
-        "status": "healthy",
-        "service": "LLM Text Generation Microservice",
-    }
+    logger.debug("Health check endpoint accessed")
+    return ORJSONResponse(
+        {
+            "status": "healthy",
+            "service": "LLM Text Generation Microservice",
+        }
+    )
+
+
+# Formatted health check timestamp, memoized per whole second
+timestamp_cache = [0, ""]
+
+
+def current_timestamp() -> str:
+    """Return the current UTC time in ISO format at one-second resolution.
+
+    Returns:
+        str: ISO 8601 timestamp, reused for every call within a second.
+    """
+    now = int(time.time())
+    if now != timestamp_cache[0]:
+        timestamp = datetime.fromtimestamp(now, UTC).isoformat()
+        timestamp_cache[:] = [now, timestamp]
+    return timestamp_cache[1]
 
 
 @app.get("/health", response_model=HealthCheckResponse)
@@ -173,20 +524,25 @@ async def health_check():
     """Check health of all service components.
 
     Returns:
-        HealthCheckResponse: Detailed health status of all components.
+        ORJSONResponse: Detailed health status of all components, shaped as
+        HealthCheckResponse.
     """
-    logging.info("Health check endpoint accessed")
+    logger.debug("Health check endpoint accessed")
     model_status = "healthy" if groq_client else "unhealthy"
     consul_status = "healthy" if consul_client else "unhealthy"
-    metrics_status = "healthy" if generate_latest() else "unhealthy"
-
-    return HealthCheckResponse(
-        status="healthy",
-        service="LLM Text Generation Microservice",
-        timestamp=datetime.now(UTC).isoformat(),
-        model_status=model_status,
-        consul_status=consul_status,
-        metrics_status=metrics_status,
+    # Metrics are served from the in-process registry, so they are available
+    # whenever the service is; rendering them here would only waste CPU
+    metrics_status = "healthy"
+
+    return ORJSONResponse(
+        {
+            "status": "healthy",
+            "service": "LLM Text Generation Microservice",
+            "timestamp": current_timestamp(),
+            "model_status": model_status,
+            "consul_status": consul_status,
+            "metrics_status": metrics_status,
+        }
     )
 
 
@@ -194,16 +550,244 @@ async def health_check():
 async def metrics():
     """Expose Prometheus metrics.
 
+    With several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory
+    before startup so every worker's samples are aggregated into one scrape.
+
+    Returns:
+        Response: Prometheus metrics in text exposition format.
+    """
+    logger.debug("Metrics endpoint accessed")
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(
+        content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST
+    )
+
+
+def cache_key(
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    model: str = GROQ_MODEL,
+) -> str:
+    """Build the cache key for a generation request.
+
+    Args:
+        prompt: The input text to generate from.
+        max_tokens: Maximum number of tokens to generate.
+        temperature: Sampling temperature for generation.
+        model: The name of the LLM model used.
+
+    Returns:
+        str: Hex digest identifying the request parameters.
+    """
+    raw = f"{model}|{max_tokens}|{temperature}|{prompt}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+async def get_cached_response(key: str) -> Optional[Dict]:
+    """Look up a generation response in the L1 and L2 caches.
+
+    Redis errors and undecodable values are logged and treated as a miss so
+    that an unavailable cache never fails the request.
+
+    Args:
+        key: Cache key built by ``cache_key``.
+
     Returns:
-        bytes: Prometheus metrics in text format.
+        dict: The cached response payload, or None on a miss.
     """
-    logging.info("Metrics endpoint accessed")
-    return generate_latest()
+    async with response_cache_lock:
+        cached = response_cache.get(key)
+    if cached is not None:
+        CACHE_HITS.labels(tier="memory").inc()
+        return cached
+
+    if redis_client is None:
+        return None
+    try:
+        raw = await redis_client.get(REDIS_KEY_PREFIX + key)
+        if raw is None:
+            return None
+        cached = msgpack.unpackb(raw)
+    except Exception as e:
+        logger.error("Failed to read from Redis cache: %s", e)
+        return None
+
+    async with response_cache_lock:
+        response_cache[key] = cached
+    CACHE_HITS.labels(tier="redis").inc()
+    return cached
 
 
+async def store_cached_response(key: str, payload: Dict) -> None:
+    """Store a generation response in the L1 and L2 caches.
+
+    Args:
+        key: Cache key built by ``cache_key``.
+        payload: Serialized TextGenerationResponse.
+    """
+    async with response_cache_lock:
+        response_cache[key] = payload
+
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(
+            REDIS_KEY_PREFIX + key,
+            msgpack.packb(payload),
+            ex=CACHE_TTL,
+        )
+    except Exception as e:
+        logger.error("Failed to write to Redis cache: %s", e)
+
+
+class SemanticIndex:
+    """Fixed-capacity inner-product index over prompt embeddings.
+
+    Works like faiss ``IndexFlatIP``: normalized vectors live in one
+    preallocated matrix, so a lookup is a single matrix-vector product.
+    Once the index is full the oldest slot is reused, and entries expire
+    after ``ttl`` seconds.
+
+    Attributes:
+        vectors: Embedding matrix, one row per slot; empty rows are zero.
+        entries: Per-slot (key, params, payload, expiry) or None.
+        slots: Slot index of each stored cache key.
+    """
+
+    def __init__(self, capacity: int, dim: int, ttl: float):
+        import numpy as np
+
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.entries: List[Optional[Tuple[str, str, Dict, float]]] = [
+            None
+        ] * capacity
+        self.slots: Dict[str, int] = {}
+        self.ttl = ttl
+        self.next_slot = 0
+
+    def search(
+        self,
+        params: str,
+        embedding: "np.ndarray",
+        threshold: float,
+    ) -> Optional[Dict]:
+        """Find the most similar live entry generated with ``params``.
+
+        Args:
+            params: Generation parameters the entry must share.
+            embedding: Normalized embedding of the incoming prompt.
+            threshold: Minimum cosine similarity for a match.
+
+        Returns:
+            dict: The matching response payload, or None.
+        """
+        import numpy as np
+
+        scores = self.vectors @ embedding
+        candidates = np.flatnonzero(scores >= threshold)
+        now = time.monotonic()
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            entry = self.entries[slot]
+            if entry is None:
+                continue
+            _, entry_params, payload, expires_at = entry
+            if expires_at <= now:
+                self.clear(slot)
+            elif entry_params == params:
+                return payload
+        return None
+
+    def add(
+        self,
+        key: str,
+        params: str,
+        embedding: "np.ndarray",
+        payload: Dict,
+    ) -> None:
+        """Store a response, replacing any entry with the same key.
+
+        Args:
+            key: Cache key built by ``cache_key``.
+            params: Generation parameters the response was produced with.
+            embedding: Normalized embedding of the prompt.
+            payload: Serialized TextGenerationResponse.
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % len(self.entries)
+            if self.entries[slot] is not None:
+                self.clear(slot)
+            self.slots[key] = slot
+        self.vectors[slot] = embedding
+        self.entries[slot] = (
+            key,
+            params,
+            payload,
+            time.monotonic() + self.ttl,
+        )
+
+    def clear(self, slot: int) -> None:
+        """Remove the entry stored in ``slot``.
+
+        Args:
+            slot: Row of the index to empty.
+        """
+        key = self.entries[slot][0]
+        self.slots.pop(key, None)
+        self.entries[slot] = None
+        self.vectors[slot] = 0
+
+
+def embed_prompt(prompt: str) -> "np.ndarray":
+    """Compute a normalized sentence embedding for a prompt.
+
+    Args:
+        prompt: The input text to embed.
+
+    Returns:
+        np.ndarray: Unit-length embedding vector (384 dimensions).
+    """
+    import numpy as np
+
+    encoding = embedding_tokenizer.encode(prompt)
+    input_ids = np.array([encoding.ids], dtype=np.int64)
+    attention_mask = np.array([encoding.attention_mask], dtype=np.int64)
+    inputs = {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "token_type_ids": np.zeros_like(input_ids),
+    }
+    names = {node.name for node in embedding_session.get_inputs()}
+    hidden = embedding_session.run(
+        None,
+        {name: value for name, value in inputs.items() if name in names},
+    )[0]
+
+    # Mean-pool token embeddings, ignoring padding
+    mask = attention_mask[..., None].astype(np.float32)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    vector = ((hidden * mask).sum(axis=1) / counts)[0]
+    return vector / max(np.linalg.norm(vector), 1e-12)
+
+
+# Only transient upstream failures are worth retrying; errors such as bad
+# credentials or an invalid request fail the same way on every attempt
 @retry(
+    retry=retry_if_exception_type(
+        (
+            groq.APIConnectionError,
+            groq.RateLimitError,
+            groq.InternalServerError,
+        )
+    ),
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
+    reraise=True,
 )
 async def generate_with_retry(
     prompt: str,
@@ -221,110 +805,425 @@ async def generate_with_retry(
         The generated text response from the LLM.
 
     Raises:
-        Exception: If text generation fails after retries.
+        Exception: If text generation fails after retries, or immediately
+            for errors that are not transient.
     """
     try:
-        logging.info("Attempting to generate text with retry logic")
-        response = groq_client.chat.completions.create(
-            model="gemma2-9b-it",
+        logger.debug("Attempting to generate text with retry logic")
+        response = await groq_client.chat.completions.create(
+            model=GROQ_MODEL,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=max_tokens,
             temperature=temperature,
         )
         return response
     except Exception as e:
-        ERROR_COUNT.inc()
-        logging.error("Error during text generation: %s", e)
+        logger.error("Error during text generation: %s", e)
         raise
 
 
-@app.post("/generate", response_model=TextGenerationResponse)
-async def generate_text(request: TextGenerationRequest):
-    """Generate text based on the provided prompt using Groq LLM.
+def generation_error(e: Exception) -> HTTPException:
+    """Map a text generation failure to an HTTP error and count it.
+
+    Upstream status codes are preserved where they tell the client what to
+    do next: back off on 429, fix credentials on 401, retry later on 502.
 
     Args:
-        request: TextGenerationRequest containing the prompt and parameters.
+        e: The exception raised while generating text.
 
     Returns:
-        TextGenerationResponse containing the generated text and metadata.
+        HTTPException: The error to return to the client.
+    """
+    logger.error("Text generation failed: %s", e)
+    detail = f"Text generation failed: {str(e)}"
+    if isinstance(e, groq.RateLimitError):
+        ERROR_COUNT.labels(kind="rate_limit").inc()
+        return HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={
+                "Retry-After": str(e.response.headers.get("retry-after", "1"))
+            },
+        )
+    if isinstance(e, groq.AuthenticationError):
+        ERROR_COUNT.labels(kind="authentication").inc()
+        return HTTPException(status_code=401, detail=detail)
+    if isinstance(e, groq.BadRequestError):
+        ERROR_COUNT.labels(kind="bad_request").inc()
+        return HTTPException(status_code=400, detail=detail)
+    if isinstance(e, groq.APIConnectionError):
+        ERROR_COUNT.labels(kind="connection").inc()
+        return HTTPException(status_code=502, detail=detail)
+    if isinstance(e, groq.APIStatusError):
+        ERROR_COUNT.labels(kind="upstream").inc()
+        return HTTPException(status_code=502, detail=detail)
+    ERROR_COUNT.labels(kind="internal").inc()
+    return HTTPException(status_code=500, detail=detail)
+
+
+def completion_payload(response) -> Dict:
+    """Serialize a Groq chat completion as a TextGenerationResponse dict.
+
+    The payload is returned as-is through ORJSONResponse, so nothing is
+    validated on the way out. Usage counters are read directly rather than
+    through ``usage.model_dump()``, which would walk the whole Groq model
+    and include its float timing fields.
+
+    Args:
+        response: Chat completion returned by the Groq client.
+
+    Returns:
+        dict: Generated text, model name and token usage.
+    """
+    usage = response.usage
+    return {
+        "generated_text": response.choices[0].message.content,
+        "model": response.model,
+        "usage": {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+        },
+    }
+
+
+def require_groq_client() -> None:
+    """Reject the request if the Groq client is not available.
 
     Raises:
-        HTTPException: If the model is not initialized or generation fails.
+        HTTPException: If the model is not initialized.
     """
-    logging.info("Generate text endpoint accessed")
     if groq_client is None:
-        logging.error("Groq client not initialized")
+        logger.error("Groq client not initialized")
         raise HTTPException(
             status_code=503,
             detail="Model service not initialized. Please try again later.",
         )
 
+
+async def generate_and_store(
+    key: str,
+    body: TextGenerationRequest,
+    params: str,
+    embedding: Optional["np.ndarray"],
+) -> Dict:
+    """Generate text with Groq and store it in every cache tier.
+
+    Args:
+        key: Cache key built by ``cache_key``.
+        body: TextGenerationRequest containing the prompt and parameters.
+        params: Model and sampling parameters the semantic cache matches on.
+        embedding: Prompt embedding for the semantic cache, if enabled.
+
+    Returns:
+        dict: The serialized TextGenerationResponse.
+    """
+    with GENERATION_TIME.time():
+        start_time = time.perf_counter()
+
+        # Generate text using Groq with retry logic
+        response = await generate_with_retry(
+            body.prompt,
+            body.max_tokens,
+            body.temperature,
+        )
+
+        # Latency is recorded by GENERATION_TIME; only log when debugging
+        logger.debug(
+            "Text generation completed in %.2f seconds",
+            time.perf_counter() - start_time,
+        )
+
+    payload = completion_payload(response)
+    await store_cached_response(key, payload)
+    if embedding is not None:
+        semantic_index.add(key, params, embedding, payload)
+    return payload
+
+
+async def generate_coalesced(
+    key: str,
+    body: TextGenerationRequest,
+    params: str,
+    embedding: Optional["np.ndarray"],
+) -> Dict:
+    """Generate and cache text once for all concurrent identical requests.
+
+    The first request for a key starts ``generate_and_store``; concurrent
+    requests with the same key await the same task instead of issuing
+    their own. The task is only removed from ``inflight_generations`` once
+    the payload is cached, so later requests are served from cache.
+
+    Args:
+        key: Cache key built by ``cache_key``.
+        body: TextGenerationRequest containing the prompt and parameters.
+        params: Model and sampling parameters the semantic cache matches on.
+        embedding: Prompt embedding for the semantic cache, if enabled.
+
+    Returns:
+        dict: The serialized TextGenerationResponse.
+    """
+    task = inflight_generations.get(key)
+    if task is not None:
+        COALESCED_REQUESTS.inc()
+    else:
+        task = asyncio.ensure_future(
+            generate_and_store(key, body, params, embedding)
+        )
+        inflight_generations[key] = task
+        task.add_done_callback(
+            lambda _: inflight_generations.pop(key, None)
+        )
+    # Shield the shared call so one client disconnecting does not cancel it
+    # for the others
+    return await asyncio.shield(task)
+
+
+async def generate_cached(
+    body: TextGenerationRequest,
+) -> Tuple[Dict, bool]:
+    """Generate text for a request, going through every cache tier first.
+
+    Identical requests are served from the in-process or Redis response
+    cache, and paraphrased prompts from the semantic cache when enabled.
+    Misses are generated and cached once per key through the in-flight
+    coalescer.
+
+    Args:
+        body: TextGenerationRequest containing the prompt and parameters.
+
+    Returns:
+        tuple: The serialized TextGenerationResponse and whether it was
+        served from cache.
+
+    Raises:
+        Exception: If text generation fails.
+    """
     REQUEST_COUNT.inc()
 
-    try:
-        with GENERATION_TIME.time():
-            start_time = time.time()
-
-            # Generate text using Groq with retry logic
-            response = await generate_with_retry(
-                request.prompt,
-                request.max_tokens,
-                request.temperature,
-            )
+    key = cache_key(body.prompt, body.max_tokens, body.temperature)
+    cached = await get_cached_response(key)
+    if cached is not None:
+        return cached, True
 
-            processing_time = time.time() - start_time
-            logging.info(
-                "Text generation completed in %.2f seconds",
-                processing_time,
+    params = f"{GROQ_MODEL}|{body.max_tokens}|{body.temperature}"
+    embedding = None
+    if semantic_index is not None:
+        try:
+            embedding = await asyncio.to_thread(embed_prompt, body.prompt)
+            cached = semantic_index.search(
+                params, embedding, SEMANTIC_CACHE_THRESHOLD
             )
+        except Exception as e:
+            logger.error("Semantic cache lookup failed: %s", e)
+            cached = None
+        if cached is not None:
+            SEMANTIC_HITS.inc()
+            return cached, True
+    CACHE_MISSES.inc()
 
-            # Register service with Consul
-            try:
-                consul_client.agent.service.register(
-                    "llm-service",
-                    service_id="llm-service-1",
-                    port=8000,
-                    check={
-                        "http": "http://localhost:8000/health",
-                        "interval": "10s",
-                    },
-                )
-            except Exception as e:
-                logging.error("Failed to register service with Consul: %s", e)
-
-            return TextGenerationResponse(
-                generated_text=response.choices[0].message.content,
-                model=response.model,
-                usage={
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens,
-                },
-            )
+    payload = await generate_coalesced(key, body, params, embedding)
+    return payload, False
+
+
+@app.post("/generate", response_model=TextGenerationResponse)
+@limiter.shared_limit(GENERATION_RATE_LIMIT, scope=GENERATION_RATE_SCOPE)
+async def generate_text(request: Request, body: TextGenerationRequest):
+    """Generate text based on the provided prompt using Groq LLM.
+
+    Responses served from cache are flagged with an ``X-Cache: HIT``
+    header.
+
+    Args:
+        request: Incoming HTTP request, used to identify the client for
+            rate limiting.
+        body: TextGenerationRequest containing the prompt and parameters.
 
+    Returns:
+        ORJSONResponse containing the generated text and metadata, shaped
+        as TextGenerationResponse.
+
+    Raises:
+        HTTPException: If the model is not initialized or generation fails,
+            with a status code reflecting the upstream failure.
+        RateLimitExceeded: If the client exceeded its request rate.
+    """
+    logger.debug("Generate text endpoint accessed")
+    require_groq_client()
+
+    try:
+        payload, hit = await generate_cached(body)
     except Exception as e:
-        ERROR_COUNT.inc()
-        logging.error("Text generation failed: %s", e)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Text generation failed: {str(e)}",
-        )
+        raise generation_error(e)
+
+    return ORJSONResponse(
+        payload,
+        headers={"X-Cache": "HIT" if hit else "MISS"},
+    )
 
 
-if __name__ == "__main__":
-    # Register service with Consul on startup
+def sse_event(data: str) -> str:
+    """Format a Server-Sent Events message.
+
+    Args:
+        data: The event payload; each line becomes its own ``data:`` field.
+
+    Returns:
+        str: The encoded event, terminated by a blank line.
+    """
+    return "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+
+@app.post("/generate/stream")
+@limiter.shared_limit(GENERATION_RATE_LIMIT, scope=GENERATION_RATE_SCOPE)
+async def generate_stream(request: Request, body: TextGenerationRequest):
+    """Stream generated text token by token as Server-Sent Events.
+
+    Each event carries the next piece of generated text and the stream
+    ends with a ``[DONE]`` event. A response already in the exact-match
+    cache is sent as a single event.
+
+    Args:
+        request: Incoming HTTP request, used to identify the client for
+            rate limiting.
+        body: TextGenerationRequest containing the prompt and parameters.
+
+    Returns:
+        StreamingResponse: ``text/event-stream`` of generated text.
+
+    Raises:
+        HTTPException: If the model is not initialized or the stream could
+            not be started, with a status code reflecting the failure.
+        RateLimitExceeded: If the client exceeded its request rate.
+    """
+    logger.debug("Generate stream endpoint accessed")
+    require_groq_client()
+    REQUEST_COUNT.inc()
+
+    key = cache_key(body.prompt, body.max_tokens, body.temperature)
+    cached = await get_cached_response(key)
+    if cached is not None:
+
+        async def cached_events():
+            yield sse_event(cached["generated_text"])
+            yield sse_event("[DONE]")
+
+        return StreamingResponse(
+            cached_events(),
+            media_type="text/event-stream",
+            headers={"X-Cache": "HIT"},
+        )
+    CACHE_MISSES.inc()
+
+    start_time = time.perf_counter()
     try:
-        consul_client.agent.service.register(
-            "llm-service",
-            service_id="llm-service-1",
-            port=8000,
-            check={
-                "http": "http://localhost:8000/health",
-                "interval": "10s",
-            },
+        stream = await groq_client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": body.prompt}],
+            max_tokens=body.max_tokens,
+            temperature=body.temperature,
+            stream=True,
         )
     except Exception as e:
-        logging.error("Failed to register with Consul: %s", e)
+        raise generation_error(e)
+
+    async def events():
+        first_token = True
+        try:
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if not content:
+                    continue
+                if first_token:
+                    TIME_TO_FIRST_TOKEN.observe(
+                        time.perf_counter() - start_time
+                    )
+                    first_token = False
+                yield sse_event(content)
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            error = generation_error(e)
+            yield f"event: error\n{sse_event(error.detail)}"
+            return
+        finally:
+            GENERATION_TIME.observe(time.perf_counter() - start_time)
+            await stream.close()
+        yield sse_event("[DONE]")
+
+    # The background close also runs when the client disconnects before or
+    # during streaming, so Groq stops generating tokens nobody will read
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"X-Cache": "MISS"},
+        background=BackgroundTask(stream.close),
+    )
 
-    # Run the FastAPI app with Uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+@app.post("/generate/batch", response_model=TextGenerationBatchResponse)
+@limiter.shared_limit(
+    GENERATION_RATE_LIMIT,
+    scope=GENERATION_RATE_SCOPE,
+    cost=batch_cost,
+)
+async def generate_batch(request: Request, body: TextGenerationBatchRequest):
+    """Generate text for several prompts concurrently in one request.
+
+    Items are generated in parallel, bounded by MAX_CONCURRENCY, and share
+    the caches and in-flight coalescing of ``/generate``, so duplicate
+    prompts in a batch result in a single Groq call. Each item counts
+    against the client's generation rate limit.
+
+    Args:
+        request: Incoming HTTP request, used to identify the client for
+            rate limiting.
+        body: TextGenerationBatchRequest containing the prompts.
+
+    Returns:
+        ORJSONResponse with one result per item, in request order, shaped
+        as TextGenerationBatchResponse. Failed items carry an error instead
+        of failing the whole batch.
+
+    Raises:
+        HTTPException: If the model is not initialized.
+        RateLimitExceeded: If the client exceeded its request rate.
+    """
+    logger.debug("Generate batch endpoint accessed")
+    require_groq_client()
+
+    async def generate_item(item: TextGenerationRequest) -> Dict:
+        async with generation_semaphore:
+            payload, _ = await generate_cached(item)
+            return payload
+
+    outcomes = await asyncio.gather(
+        *(generate_item(item) for item in body.items),
+        return_exceptions=True,
+    )
+
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            error = generation_error(outcome)
+            outcome = {
+                "status_code": error.status_code,
+                "detail": error.detail,
+            }
+        results.append(outcome)
+    return ORJSONResponse({"results": results})
+
+
+if __name__ == "__main__":
+    # Run the FastAPI app with Uvicorn. Each worker is a separate process
+    # with its own clients; Consul registration uses a fixed service ID, so
+    # registering from every worker is idempotent. Defaults to one worker:
+    # more need PROMETHEUS_MULTIPROC_DIR for metrics and REDIS_URL for a
+    # shared rate limit.
+    uvicorn.run(
+        "microservice_llm:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", 1)),
+    )
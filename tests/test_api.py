@@ -1,7 +1,146 @@
 """Tests for the LLM Text Generation Microservice API."""
 
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+import groq
 import pytest
 import httpx
+import numpy as np
+from prometheus_client import CONTENT_TYPE_LATEST
+from tenacity import wait_none
+
+from microservice_llm import microservice_llm as service
+
+GROQ_REQUEST = httpx.Request("POST", "https://api.groq.com/openai/v1/chat")
+
+
+class StubStream:
+    """Stand-in for a streamed Groq completion.
+
+    Attributes:
+        parts: Text deltas to yield, None for deltas without content.
+        error: Exception to raise after the last delta, if any.
+        closed: Whether ``close`` was called.
+    """
+
+    def __init__(self, parts, error=None):
+        self.parts = parts
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for part in self.parts:
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=part))]
+            )
+        if self.error is not None:
+            raise self.error
+
+    async def close(self):
+        self.closed = True
+
+
+class StubCompletions:
+    """Stand-in for ``groq_client.chat.completions`` recording each call.
+
+    Attributes:
+        calls: Keyword arguments of every ``create`` call.
+        errors: Exception to raise, keyed by prompt.
+        streams: Streams returned for ``stream=True`` calls.
+        stream_parts: Text deltas yielded by each new stream.
+        stream_error: Exception raised by each new stream after its deltas.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.errors = {}
+        self.streams = []
+        self.stream_parts = ["Hel", "lo\nwor", None, "ld"]
+        self.stream_error = None
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        prompt = kwargs["messages"][0]["content"]
+        if kwargs.get("stream"):
+            stream = StubStream(self.stream_parts, self.stream_error)
+            self.streams.append(stream)
+            return stream
+        await asyncio.sleep(0.05)
+        if prompt in self.errors:
+            raise self.errors[prompt]
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    message=SimpleNamespace(content=f"Echo: {prompt}")
+                )
+            ],
+            model=kwargs["model"],
+            usage=SimpleNamespace(
+                prompt_tokens=1,
+                completion_tokens=2,
+                total_tokens=3,
+            ),
+        )
+
+
+class StubRedis:
+    """Stand-in for a misbehaving Redis client.
+
+    Attributes:
+        value: Raw value returned by ``get``.
+        error: Exception raised by ``get`` and ``set``, if any.
+    """
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    async def get(self, key):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    async def set(self, key, value, ex=None):
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Replace the Groq client with a stub and reset per-test state."""
+    stub = StubCompletions()
+    monkeypatch.setattr(
+        service,
+        "groq_client",
+        SimpleNamespace(chat=SimpleNamespace(completions=stub)),
+    )
+    # Keep retries but skip the backoff between attempts
+    monkeypatch.setattr(
+        service,
+        "generate_with_retry",
+        service.generate_with_retry.retry_with(wait=wait_none()),
+    )
+    service.response_cache.clear()
+    service.limiter.reset()
+    return stub
+
+
+def unit_vector(*components):
+    """Build a normalized float32 embedding from its components."""
+    vector = np.array(components, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def groq_status_error(error_class, status_code, headers=None):
+    """Build a Groq API status error as raised by the SDK."""
+    response = httpx.Response(
+        status_code,
+        headers=headers,
+        request=GROQ_REQUEST,
+    )
+    return error_class("Groq error", response=response, body=None)
 
 
 @pytest.mark.asyncio
@@ -33,7 +172,19 @@ async def test_metrics():
     async with httpx.AsyncClient() as client:
         response = await client.get("http://localhost:8000/metrics")
         assert response.status_code == 200
-        assert response.headers["content-type"] == "text/plain; version=0.0.4"
+        assert response.headers["content-type"] == CONTENT_TYPE_LATEST
+
+
+def test_metrics_reads_multiprocess_dir(monkeypatch, tmp_path):
+    """Test /metrics aggregates the multiprocess directory when set."""
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    client = TestClient(service.app)
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    # The directory is empty, so the in-process counters are not reported
+    assert b"request_count" not in response.content
 
 
 @pytest.mark.asyncio
@@ -48,5 +199,259 @@ async def test_generate_text_without_api_key():
                 "temperature": 0.7
             }
         )
-        assert response.status_code == 500  # or 401 depending on your error handling
-        assert "error" in response.json()
+        # 401 when Groq rejects the key, 503 when no client could be created
+        assert response.status_code in (401, 503)
+        assert "detail" in response.json()
+
+
+@pytest.mark.parametrize(
+    "error, status_code, attempts",
+    [
+        (
+            groq_status_error(
+                groq.RateLimitError, 429, headers={"retry-after": "7"}
+            ),
+            429,
+            3,
+        ),
+        (groq_status_error(groq.AuthenticationError, 401), 401, 1),
+        (groq_status_error(groq.BadRequestError, 400), 400, 1),
+        (groq_status_error(groq.InternalServerError, 500), 502, 3),
+        (groq.APIConnectionError(request=GROQ_REQUEST), 502, 3),
+        (ValueError("unexpected"), 500, 1),
+    ],
+)
+def test_generate_text_maps_groq_errors(
+    completions, error, status_code, attempts
+):
+    """Test Groq failures map to status codes and only transient ones retry."""
+    completions.errors["Test prompt"] = error
+    client = TestClient(service.app)
+
+    response = client.post("/generate", json={"prompt": "Test prompt"})
+
+    assert response.status_code == status_code
+    assert "detail" in response.json()
+    assert len(completions.calls) == attempts
+    if status_code == 429:
+        assert response.headers["retry-after"] == "7"
+
+
+def test_generate_text_serves_repeats_from_cache(completions):
+    """Test an identical request is answered from cache without Groq."""
+    client = TestClient(service.app)
+
+    first = client.post("/generate", json={"prompt": "Cache me"})
+    second = client.post("/generate", json={"prompt": "Cache me"})
+    other = client.post(
+        "/generate", json={"prompt": "Cache me", "temperature": 0.1}
+    )
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert other.headers["x-cache"] == "MISS"
+    assert second.json() == first.json() == {
+        "generated_text": "Echo: Cache me",
+        "model": service.GROQ_MODEL,
+        "usage": {
+            "prompt_tokens": 1,
+            "completion_tokens": 2,
+            "total_tokens": 3,
+        },
+    }
+    assert len(completions.calls) == 2
+
+
+@pytest.mark.parametrize(
+    "redis_client",
+    [
+        StubRedis(value=b"\xc1 not msgpack"),
+        StubRedis(error=TimeoutError("Timeout reading from socket")),
+    ],
+    ids=["garbage", "timeout"],
+)
+def test_generate_text_fails_open_on_redis_errors(
+    completions, monkeypatch, redis_client
+):
+    """Test a broken Redis cache is treated as a miss, not a failure."""
+    monkeypatch.setattr(service, "redis_client", redis_client)
+    client = TestClient(service.app)
+
+    response = client.post("/generate", json={"prompt": "Redis is down"})
+
+    assert response.status_code == 200
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["generated_text"] == "Echo: Redis is down"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_one_call(
+    completions, monkeypatch
+):
+    """Test concurrent identical requests share one Groq call and store."""
+    stored = []
+    store_cached_response = service.store_cached_response
+
+    async def record_store(key, payload):
+        stored.append(key)
+        await store_cached_response(key, payload)
+
+    monkeypatch.setattr(service, "store_cached_response", record_store)
+    transport = httpx.ASGITransport(app=service.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as client:
+        responses = await asyncio.gather(
+            *(
+                client.post("/generate", json={"prompt": "Viral prompt"})
+                for _ in range(10)
+            )
+        )
+
+    assert [response.status_code for response in responses] == [200] * 10
+    assert {response.json()["generated_text"] for response in responses} == {
+        "Echo: Viral prompt"
+    }
+    assert len(completions.calls) == 1
+    assert len(stored) == 1
+    assert not service.inflight_generations
+
+
+def test_batch_shares_calls_for_duplicate_items(completions):
+    """Test duplicate batch items are generated once and keep their order."""
+    client = TestClient(service.app)
+
+    response = client.post(
+        "/generate/batch",
+        json={"items": [{"prompt": "a"}, {"prompt": "a"}, {"prompt": "b"}]},
+    )
+
+    assert response.status_code == 200
+    assert [
+        result["generated_text"] for result in response.json()["results"]
+    ] == ["Echo: a", "Echo: a", "Echo: b"]
+    assert len(completions.calls) == 2
+
+
+def test_batch_reports_item_errors(completions):
+    """Test a failed batch item carries its error without failing the rest."""
+    completions.errors["bad"] = groq_status_error(groq.BadRequestError, 400)
+    client = TestClient(service.app)
+
+    response = client.post(
+        "/generate/batch",
+        json={"items": [{"prompt": "good"}, {"prompt": "bad"}]},
+    )
+
+    assert response.status_code == 200
+    good, bad = response.json()["results"]
+    assert good["generated_text"] == "Echo: good"
+    assert bad["status_code"] == 400
+    assert "detail" in bad
+
+
+def test_batch_items_count_against_rate_limit(completions):
+    """Test every batch item is charged to the shared generation limit."""
+    client = TestClient(service.app)
+    items = [{"prompt": f"item {index}"} for index in range(16)]
+
+    assert client.post(
+        "/generate/batch", json={"items": items}
+    ).status_code == 200
+    assert client.post(
+        "/generate/batch", json={"items": items}
+    ).status_code == 429
+    statuses = [
+        client.post("/generate", json={"prompt": f"single {index}"})
+        .status_code
+        for index in range(15)
+    ]
+
+    assert statuses == [200] * 14 + [429]
+
+
+def test_batch_cost_requires_parsed_body():
+    """Test batch cost fails loudly instead of charging a single hit."""
+    assert service.batch_cost(SimpleNamespace(_json={"items": [1, 2]})) == 2
+    with pytest.raises(RuntimeError):
+        service.batch_cost(SimpleNamespace())
+
+
+def test_generate_stream_sends_sse_events(completions):
+    """Test streamed deltas are framed as SSE events and the stream closed."""
+    client = TestClient(service.app)
+
+    response = client.post("/generate/stream", json={"prompt": "Stream"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        "data: Hel\n\n"
+        "data: lo\ndata: wor\n\n"
+        "data: ld\n\n"
+        "data: [DONE]\n\n"
+    )
+    assert completions.streams[0].closed
+
+
+def test_generate_stream_reports_errors_in_band(completions):
+    """Test a failure after streaming starts is sent as an error event."""
+    completions.stream_parts = ["partial"]
+    completions.stream_error = groq.APIConnectionError(request=GROQ_REQUEST)
+    client = TestClient(service.app)
+
+    response = client.post("/generate/stream", json={"prompt": "Stream"})
+
+    assert response.status_code == 200
+    assert response.text.startswith("data: partial\n\nevent: error\ndata: ")
+    assert "[DONE]" not in response.text
+    assert completions.streams[0].closed
+
+
+def test_semantic_index_returns_similar_entry():
+    """Test a prompt above the similarity threshold hits its neighbour."""
+    index = service.SemanticIndex(capacity=4, dim=3, ttl=60)
+    index.add("a", "m|100|0.7", unit_vector(1, 0, 0), {"text": "a"})
+    index.add("b", "m|100|0.7", unit_vector(0, 1, 0), {"text": "b"})
+
+    assert index.search("m|100|0.7", unit_vector(1, 0.1, 0), 0.9) == {
+        "text": "a"
+    }
+    assert index.search("m|100|0.7", unit_vector(1, 1, 0), 0.9) is None
+
+
+def test_semantic_index_requires_matching_params():
+    """Test a similar prompt generated with other parameters misses."""
+    index = service.SemanticIndex(capacity=4, dim=3, ttl=60)
+    index.add("a", "m|100|0.7", unit_vector(1, 0, 0), {"text": "a"})
+
+    assert index.search("m|100|0.1", unit_vector(1, 0, 0), 0.9) is None
+
+
+def test_semantic_index_evicts_oldest_when_full():
+    """Test a full index reuses the oldest slot for a new entry."""
+    index = service.SemanticIndex(capacity=2, dim=3, ttl=60)
+    index.add("a", "p", unit_vector(1, 0, 0), {"text": "a"})
+    index.add("b", "p", unit_vector(0, 1, 0), {"text": "b"})
+    index.add("c", "p", unit_vector(0, 0, 1), {"text": "c"})
+
+    assert index.slots == {"b": 1, "c": 0}
+    assert index.search("p", unit_vector(1, 0, 0), 0.9) is None
+    assert index.search("p", unit_vector(0, 1, 0), 0.9) == {"text": "b"}
+    assert index.search("p", unit_vector(0, 0, 1), 0.9) == {"text": "c"}
+
+
+def test_semantic_index_expires_entries(monkeypatch):
+    """Test entries stop matching and are cleared once ``ttl`` passes."""
+    now = 1000.0
+    monkeypatch.setattr(service.time, "monotonic", lambda: now)
+    index = service.SemanticIndex(capacity=2, dim=3, ttl=60)
+    index.add("a", "p", unit_vector(1, 0, 0), {"text": "a"})
+
+    now += 59
+    assert index.search("p", unit_vector(1, 0, 0), 0.9) == {"text": "a"}
+
+    now += 1
+    assert index.search("p", unit_vector(1, 0, 0), 0.9) is None
+    assert index.slots == {}
+    assert index.entries == [None, None]